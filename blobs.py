@@ -0,0 +1,188 @@
+# coding=utf-8
+import hashlib
+import os
+import tempfile
+
+
+class BlobStore(object):
+    """
+    Content-addressed storage for large field values. Each value is stored once as UTF-8 in a file named after
+    its SHA-1 digest, under a subdirectory named after the first two hex digits.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.known = set()
+
+    def path(self, digest):
+        return blob_path(self.directory, digest)
+
+    def put(self, data):
+        """
+        Store the UTF-8 encoded data and return its digest.
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        if digest in self.known:
+            return digest
+        path = self.path(digest)
+        if not os.path.exists(path):
+            dirname = os.path.dirname(path)
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    # another thread may have created it
+                    if not os.path.isdir(dirname):
+                        raise
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, path)
+        self.known.add(digest)
+        return digest
+
+
+class BlobRef(object):
+    """
+    A reference to a field value stored in a blob file, read on first access to value.
+
+    Behaves like the referenced text for comparison, hashing, len, indexing, iteration, concatenation and
+    string methods, but is not a unicode instance; use value, or resolve_blobs on a note table, where a real
+    unicode object is needed.
+    """
+    __slots__ = ('directory', 'path', 'digest', 'size', '_value')
+
+    def __init__(self, directory, digest, size):
+        self.directory = directory
+        self.path = blob_path(directory, digest)
+        self.digest = digest
+        self.size = size
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if hashlib.sha1(data).hexdigest() != self.digest:
+                raise ValueError('blob %s does not match its digest' % self.path)
+            self._value = data.decode('utf-8')
+        return self._value
+
+    def __reduce__(self):
+        # pickle the reference only, never the text
+        return BlobRef, (self.directory, self.digest, self.size)
+
+    def __getattr__(self, name):
+        # string methods such as startswith, split or encode, but not the special methods pickle and copy look
+        # up, nor unset slots or value, which would recurse
+        if name.startswith('__') or name == 'value' or name in BlobRef.__slots__:
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __eq__(self, other):
+        if isinstance(other, BlobRef):
+            return self.digest == other.digest
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.value < other
+
+    def __le__(self, other):
+        return self.value <= other
+
+    def __gt__(self, other):
+        return self.value > other
+
+    def __ge__(self, other):
+        return self.value >= other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, i):
+        return self.value[i]
+
+    def __getslice__(self, i, j):
+        return self.value[i:j]
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __contains__(self, s):
+        return s in self.value
+
+    def __add__(self, other):
+        return self.value + other
+
+    def __radd__(self, other):
+        return other + self.value
+
+    def __mod__(self, args):
+        return self.value % args
+
+    def __unicode__(self):
+        return self.value
+
+    def __str__(self):
+        return self.value.encode('utf-8')
+
+    def __repr__(self):
+        return 'BlobRef(%r, %r)' % (self.digest, self.size)
+
+
+def blob_path(directory, digest):
+    return os.path.join(directory, digest[:2], digest)
+
+
+def blob_directory(path):
+    """
+    Return the blob directory the exporter uses for the export file at path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(path)), 'blobs')
+
+
+def is_blob_ref(v):
+    return isinstance(v, dict) and len(v) == 2 and 'blob' in v and 'size' in v
+
+
+class BlobTranslator(object):
+    """
+    A pytoml translate function that turns blob references into lazily loaded BlobRef values.
+    Instances can be pickled, so they also work with pytoml.loads_parallel.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, kind, text, value):
+        if kind == 'table' and is_blob_ref(value):
+            return BlobRef(self.directory, value['blob'], value['size'])
+        return value
+
+
+blob_translator = BlobTranslator
+
+
+def default_translator(path):
+    """
+    Return a BlobTranslator for the blobs directory next to the export file at path, or None if there is none.
+    """
+    directory = blob_directory(path)
+    return BlobTranslator(directory) if os.path.isdir(directory) else None
+
+
+def resolve_blobs(d, directory):
+    """
+    Replace blob references among the values of d with the referenced text, in place.
+    """
+    for k, v in d.items():
+        if isinstance(v, BlobRef):
+            d[k] = v.value
+        elif is_blob_ref(v):
+            d[k] = BlobRef(directory, v['blob'], v['size']).value
+    return d
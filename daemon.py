@@ -0,0 +1,260 @@
+# coding=utf-8
+"""
+A long running export server that keeps collections open and their caches warm.
+
+Requests are JSON objects sent one per line over a Unix socket, each answered with one JSON line:
+
+    {"collection": "/path/collection.anki2", "profile": "/path/profile.toml", "output": "/path/export.toml"}
+    {"command": "stats"}
+
+Every collection is served by its own worker thread, since a collection's sqlite connection can only be used
+from the thread that opened it. Exports against different collections run concurrently, exports against the same
+collection are queued. Collections are opened without Anki's write lock, so Anki and other writers keep working
+on them, and are closed again once their worker has been idle for idle_timeout seconds.
+"""
+import Queue
+import SocketServer
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from anki import Collection
+
+from exporter import OutputModel, keydefaultdict, profile_exporter
+import pytoml as toml
+
+log = logging.getLogger(__name__)
+
+class ProfileCache(object):
+    """
+    Parsed export profiles, reparsed when the file's size or mtime changes. Profiles that do need parsing go
+    through parse_cache, a pytoml.ParseCache, when given, so they survive restarts of the server.
+    """
+    def __init__(self, parse_cache=None):
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.parse_cache = parse_cache
+
+    def get(self, path):
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime)
+        with self.lock:
+            cached = self.profiles.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(path, 'r') as f:
+            profile = toml.load(f, cache=self.parse_cache)
+        with self.lock:
+            self.profiles[path] = (key, profile)
+        return profile
+
+
+class Stats(object):
+    """
+    Request latency and throughput counters
+    """
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.notes = 0
+        self.busy = 0.0
+        self.latencies = collections.deque(maxlen=window)
+
+    def record(self, seconds, notes=0, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.notes += notes
+            self.busy += seconds
+            self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            latencies = sorted(self.latencies)
+            snapshot = {
+                'uptime': uptime,
+                'requests': self.requests,
+                'errors': self.errors,
+                'notes': self.notes,
+                'requests-per-second': self.requests / uptime,
+                'notes-per-second': self.notes / self.busy if self.busy else 0.0,
+            }
+        if latencies:
+            snapshot['latency-p50'] = latencies[len(latencies) // 2]
+            snapshot['latency-p95'] = latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)]
+            snapshot['latency-max'] = latencies[-1]
+        return snapshot
+
+
+class CollectionWorker(threading.Thread):
+    """
+    Owns one collection and runs the exports against it in order
+    """
+    def __init__(self, path, profiles, idle_timeout=60, request_timeout=3600):
+        threading.Thread.__init__(self, name='collection %s' % path)
+        self.daemon = True
+        self.path = path
+        self.profiles = profiles
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self.jobs = Queue.Queue()
+        self.col = None
+        self.output_models = None
+        self.col_mod = None
+
+    def submit(self, request):
+        """
+        Queue an export request and wait for its result, giving up when the worker died or the request took longer
+        than request_timeout seconds.
+        """
+        done = threading.Event()
+        job = [request, done, None]
+        self.jobs.put(job)
+        deadline = time.time() + self.request_timeout
+        while not done.wait(1):
+            if not self.is_alive():
+                return {'ok': False, 'error': 'collection worker stopped'}
+            if time.time() > deadline:
+                return {'ok': False, 'error': 'timed out after %d seconds' % self.request_timeout}
+        return job[2]
+
+    def run(self):
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.idle_timeout)
+            except Queue.Empty:
+                self.close_collection()
+                continue
+            if job is None:
+                break
+            request, done = job[0], job[1]
+            try:
+                job[2] = self.export(request)
+            except Exception as e:
+                job[2] = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+            done.set()
+        self.close_collection()
+
+    def close_collection(self):
+        if self.col is not None:
+            try:
+                self.col.close(save=False)
+            except Exception:
+                log.exception('closing %s failed', self.path)
+            self.col = None
+            self.col_mod = None
+
+    def export(self, request):
+        if self.col is None:
+            self.col = Collection(self.path, lock=False)
+        col = self.col
+        # other processes may have changed the collection since it was loaded, col.mod is only read on load
+        mod = col.db.scalar("SELECT mod FROM col")
+        if mod != self.col_mod:
+            if self.col_mod is not None:
+                col.load()
+            # models may have changed, start over with fresh output models
+            self.output_models = keydefaultdict(lambda mid: OutputModel(col.models, mid))
+            self.col_mod = mod
+        profile = self.profiles.get(request['profile'])
+        exporter = profile_exporter(col, profile, output_models=self.output_models)
+        exporter.doExport(request['output'])
+        return {'ok': True, 'count': exporter.count}
+
+    def stop(self):
+        self.jobs.put(None)
+
+
+class ExportServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, parse_cache=None, idle_timeout=60, request_timeout=3600):
+        self.profiles = ProfileCache(parse_cache)
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self.stats = Stats()
+        self.workers = {}
+        self.workers_lock = threading.Lock()
+        # binding may fail and call server_close, which needs the workers
+        SocketServer.UnixStreamServer.__init__(self, socket_path, ExportRequestHandler)
+
+    def worker(self, path):
+        path = os.path.abspath(path)
+        with self.workers_lock:
+            worker = self.workers.get(path)
+            if worker is None or not worker.is_alive():
+                worker = self.workers[path] = CollectionWorker(path, self.profiles, self.idle_timeout,
+                                                               self.request_timeout)
+                worker.start()
+        return worker
+
+    def handle_request_data(self, request):
+        if request.get('command') == 'stats':
+            return dict(self.stats.snapshot(), ok=True, collections=sorted(self.workers.keys()))
+
+        t0 = time.time()
+        result = self.worker(request['collection']).submit(request)
+        seconds = time.time() - t0
+        self.stats.record(seconds, result.get('count', 0), not result['ok'])
+        result['seconds'] = seconds
+        return result
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        with self.workers_lock:
+            for worker in self.workers.values():
+                worker.stop()
+            for worker in self.workers.values():
+                worker.join()
+
+
+class ExportRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                result = self.server.handle_request_data(request)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                result = {'ok': False, 'error': 'bad request: %s' % e}
+            self.wfile.write(json.dumps(result) + '\n')
+            self.wfile.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve ankisport exports over a Unix socket.')
+    parser.add_argument('socket', help='path of the Unix socket to listen on')
+    parser.add_argument('--parse-cache', metavar='DIR', help='keep parsed profiles in a pytoml.ParseCache in DIR')
+    parser.add_argument('--parse-cache-size', type=int, default=64 * 1024 * 1024, metavar='BYTES',
+                        help='size limit of the parse cache directory')
+    parser.add_argument('--idle-timeout', type=float, default=60, metavar='SECONDS',
+                        help='close a collection after it has not been used for this long')
+    parser.add_argument('--request-timeout', type=float, default=3600, metavar='SECONDS',
+                        help='answer an export request with an error when it takes longer than this')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(threadName)s: %(message)s')
+
+    parse_cache = toml.ParseCache(args.parse_cache, args.parse_cache_size) if args.parse_cache else None
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = ExportServer(args.socket, parse_cache, args.idle_timeout, args.request_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,27 @@
 # coding=utf-8
+import Queue
 import json
 import subprocess
+import sys
 import textwrap
+import threading
+import time
 from collections import defaultdict
 from datetime import datetime
 from itertools import islice, izip
 
 import codecs
+import hashlib
 import os
 import re
 from anki.exporting import Exporter
+from anki.lang import _
 from anki.utils import splitFields, ids2str
-from aqt.utils import showWarning
 
 import pytoml as toml
+from blobs import BlobStore, blob_directory, resolve_blobs
+from records import toml_field_names
+from transforms import compile_plan
 
 
 class keydefaultdict(defaultdict):
@@ -34,9 +42,14 @@ class TOMLGenerator(object):
     escape_re_sub_tab = {'\t': 't', '\n': 'n', '\"': '"', '\r': 'r', '\\': '\\', '\f': 'f', '\b': 'b', '"""': r'"""'}
     ml_escape_re = re.compile(r'([\x00-\x09\x0b-\x1f\\]|""")')
     ws_match_re = re.compile(r'^[\t ]+')
+    literal_unsafe_re = re.compile(r"[\x00-\x1f\x7f']")
 
-    def __init__(self, output):
+    def __init__(self, output, compact=False):
+        """
+        :param compact: Write every string on one line in its shortest form instead of wrapping long strings.
+        """
         self.output = output
+        self.compact = compact
         self.text_wrapper = textwrap.TextWrapper(width=120, expand_tabs=False, replace_whitespace=False, drop_whitespace=False)
 
     @classmethod
@@ -67,7 +80,15 @@ class TOMLGenerator(object):
             tw.initial_indent = ''
         return lines
 
+    def write_compact_string(self, v):
+        if self.literal_unsafe_re.search(v) is None:
+            self.output.write(u"'%s'\n" % v)
+        else:
+            self.output.write(u'"%s"\n' % self.escape_string(v))
+
     def write_string(self, line_offset, v):
+        if self.compact:
+            return self.write_compact_string(v)
         output = self.output
         ws_match_re = self.ws_match_re
 
@@ -138,50 +159,257 @@ class TOMLGenerator(object):
             if isinstance(v, t):
                 return c(self, line_offset, v)
 
-    def write_key_value(self, k, v):
+    def write_key(self, k):
         if re.search(r"[^A-Za-z0-9_-]", k):
             ko = '"%s" = ' % self.escape_string(k)
         else:
             ko = '%s = ' % k
         self.output.write(ko)
-        self.write_value(len(ko), v)
+        return len(ko)
+
+    def write_key_value(self, k, v):
+        self.write_value(self.write_key(k), v)
+
+    def write_key_blob(self, k, digest, size):
+        self.write_key(k)
+        self.output.write("{ blob = '%s', size = %d }\n" % (digest, size))
 
 
 class OutputModel(object):
     def __init__(self, models, mid):
         model = models.get(mid)
-        field_names = models.fieldNames(model)
-        field_set = set(field_names)
-
-        def transform_name(name):
-            """
-            Transform names to be unquoted TOML key friendly.
-            Do it only if it will not cause ambiguity.
-            """
-            n = name.lower().replace(' ', '-')
-            return n if n not in field_set else name
-
-        self.field_names = [transform_name(fn) for fn in field_names]
+        self.field_names = toml_field_names(models.fieldNames(model))
         self.name = model['name']
         self.model = model
 
 
+class DigestWriter(object):
+    """
+    A UTF-8 output file that keeps track of the number of bytes written and their SHA-1 digest
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.size = 0
+        self.sha1 = hashlib.sha1()
+
+    def write(self, s):
+        data = s.encode('utf-8')
+        self.file.write(data)
+        self.size += len(data)
+        self.sha1.update(data)
+
+    def close(self):
+        self.file.close()
+
+
+class ShardWriter(object):
+    """
+    Note output for one group that rolls over to a new shard file once the current one holds max_notes notes
+    or at least max_bytes bytes. Without any limit all notes are written to path itself.
+
+    With index set, a JSON sidecar is written next to each file mapping every note's guid to the byte offset and
+    length of its block, along with the file's size and digest.
+    """
+    def __init__(self, path, max_notes=None, max_bytes=None, index=False):
+        self.path = path
+        self.max_notes = max_notes
+        self.max_bytes = max_bytes
+        self.sharded = bool(max_notes or max_bytes)
+        self.index = index
+        self.shards = []
+        self.output = None
+        self.count = 0
+        self.first_key = self.last_key = None
+        self.note_start = None
+        self.note_index = {}
+        self.note_id_index = {}
+        self.sort_key_index = defaultdict(list)
+        if not self.sharded:
+            self.roll()
+
+    def shard_path(self, n):
+        base, ext = os.path.splitext(self.path)
+        return '%s.%04d%s' % (base, n, ext)
+
+    def start_note(self, sort_key, guid):
+        """
+        Must be called before writing each note, the shard is only switched on note boundaries.
+        """
+        if self.sharded and (self.output is None
+                             or (self.max_notes and self.count >= self.max_notes)
+                             or (self.max_bytes and self.output.size >= self.max_bytes)):
+            self.roll()
+        if self.count == 0:
+            self.first_key = sort_key
+        self.last_key = sort_key
+        self.count += 1
+        self.note_start = (sort_key, guid, self.output.size)
+
+    def end_note(self, note_id=None):
+        """
+        Must be called after writing each note.
+        """
+        sort_key, guid, offset = self.note_start
+        self.note_start = None
+        if not self.index:
+            return
+        self.note_index[guid] = (offset, self.output.size - offset)
+        if note_id is not None:
+            self.note_id_index[note_id] = guid
+        self.sort_key_index[unicode(sort_key)].append(guid)
+
+    def write(self, s):
+        self.output.write(s)
+
+    def roll(self):
+        self.finish_shard()
+        path = self.shard_path(len(self.shards) + 1) if self.sharded else self.path
+        self.output = DigestWriter(path)
+        self.count = 0
+        self.first_key = self.last_key = None
+
+    def finish_shard(self):
+        output = self.output
+        if output is None:
+            return
+        output.close()
+        if self.index:
+            self.write_note_index(output)
+        self.shards.append({
+            'path': output.path,
+            'notes': self.count,
+            'bytes': output.size,
+            'sha1': output.sha1.hexdigest(),
+            'first-key': unicode(self.first_key) if self.first_key is not None else u'',
+            'last-key': unicode(self.last_key) if self.last_key is not None else u'',
+        })
+        self.output = None
+
+    def write_note_index(self, output):
+        with open(note_index_path(output.path), 'wb') as f:
+            json.dump({
+                'file': os.path.basename(output.path),
+                'size': output.size,
+                'sha1': output.sha1.hexdigest(),
+                'notes': self.note_index,
+                'note-ids': self.note_id_index,
+                'sort-keys': self.sort_key_index,
+            }, f)
+        self.note_index = {}
+        self.note_id_index = {}
+        self.sort_key_index = defaultdict(list)
+
+    def close(self):
+        """
+        Close the current shard and return the list of shard descriptions.
+        """
+        self.finish_shard()
+        return self.shards
+
+
+def note_index_path(path):
+    return path + '.idx'
+
+
+class TextBuffer(object):
+    """
+    Collects written text in memory
+    """
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def getvalue(self):
+        return u''.join(self.parts)
+
+
+class PipelineStage(threading.Thread):
+    """
+    A pipeline thread that takes batches from an input queue, hands each to func and puts the result on the output
+    queue. A None batch ends the stage and is passed on downstream. Time spent blocked on either queue is
+    accumulated as stall time, time spent in func as busy time.
+    """
+    def __init__(self, name, func, input, output=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.func = func
+        self.input = input
+        self.output = output
+        self.busy = 0.0
+        self.stall = 0.0
+        self.error = None
+
+    def run(self):
+        while True:
+            t0 = time.time()
+            batch = self.input.get()
+            t1 = time.time()
+            self.stall += t1 - t0
+            if batch is None:
+                break
+            if self.error is not None:
+                # keep draining so upstream stages never block on a full queue
+                continue
+            try:
+                result = self.func(batch)
+            except Exception:
+                self.error = sys.exc_info()
+                continue
+            t2 = time.time()
+            self.busy += t2 - t1
+            if self.output is not None:
+                self.output.put(result)
+                self.stall += time.time() - t2
+        if self.output is not None:
+            self.output.put(None)
+
+
 class TOMLNoteExporter(Exporter):
     key = _("Notes in TOML format")
     ext = ".toml"
 
-    def __init__(self, col, query=None, sets=None, set_name=''):
+    def __init__(self, col, query=None, sets=None, set_name='', shard_notes=None, shard_bytes=None,
+                 pipeline=False, pipeline_batch=256, pipeline_depth=8, blob_threshold=None, output_models=None,
+                 compact=False, index=False, transforms=None, media_prefix=u''):
         """
         Create a TOML Note Exporter.
         
         :param col: The anki collection object. 
         :param query: An anki filter string to select notes for export.
         :param sets: A set of tags to break the cards into smaller files.
+        :param shard_notes: Start a new shard file after this many notes.
+        :param shard_bytes: Start a new shard file once the current one reaches this many bytes.
+        :param pipeline: Overlap reading, serialization and writing in separate threads.
+        :param pipeline_batch: Number of notes passed between pipeline stages at a time.
+        :param pipeline_depth: Maximum number of batches queued between two pipeline stages.
+        :param blob_threshold: Store field values of at least this many UTF-8 bytes in blob files next to the
+            output and reference them by digest.
+        :param output_models: A keydefaultdict of OutputModels by model id to share across exports.
+        :param compact: Write strings in their shortest single line form.
+        :param index: Write a guid index next to each output file for random access with noteindex.NoteIndex.
+        :param transforms: Transform names to apply by field name by model name, see transforms.TransformPlan.
+        :param media_prefix: Prefix for media file names used by the media-paths transform.
         """
         Exporter.__init__(self, col)
         self.query = query
         self.sets = sets
         self.set_name = set_name
+        self.shard_notes = shard_notes
+        self.shard_bytes = shard_bytes
+        self.pipeline = pipeline
+        self.pipeline_batch = pipeline_batch
+        self.pipeline_depth = pipeline_depth
+        self.blob_threshold = blob_threshold
+        self.blobs = None
+        self.output_models = output_models
+        self.compact = compact
+        self.index = index
+        self.transforms = transforms
+        self.media_prefix = media_prefix
+        self.transform_plans = None
+        # (stage, busy seconds, stall seconds) for each pipeline stage run
+        self.stage_stats = []
 
     def exportInto(self, path):
         file = codecs.open(path, "w", encoding='utf-8')
@@ -190,55 +418,62 @@ class TOMLNoteExporter(Exporter):
 
     def doExport(self, path, verify=False):
         models = self.col.models
-        output_models = keydefaultdict(lambda mid: OutputModel(models, mid))
-
-        count = 0
-        grouped_notes = []
-        sets = None
-        if self.query is not None:
-            if self.sets:
-                sets = self.sets
-                for group_name, expr in sets.items():
-                    grouped_notes.append((group_name, self.col.findNotes('(%s) (%s)' % (self.query, expr))))
-            else:
-                grouped_notes.append(('', self.col.findNotes('%s' % self.query)))
+        shared_models = self.output_models
+        if shared_models is None:
+            output_models = keydefaultdict(lambda mid: OutputModel(models, mid))
         else:
-            grouped_notes.append(('', self.cardIds()))
+            # a view of the shared models, so only the models of exported notes are written
+            output_models = keydefaultdict(lambda mid: shared_models[mid])
+        if self.transforms:
+            options = {'media-prefix': self.media_prefix}
+            self.transform_plans = keydefaultdict(
+                lambda mid: compile_plan(output_models[mid], self.transforms, options))
 
+        count = 0
+        self.stage_stats = []
+        if self.blob_threshold:
+            self.blobs = BlobStore(blob_directory(path))
         paths = []
-        for group_name, note_ids in grouped_notes:
-            if group_name:
-                dirname, _ = os.path.split(path)
-                cur_path = os.path.join(dirname, group_name + '.toml')
-            else:
-                cur_path = path
-            with codecs.open(cur_path, 'w', encoding='utf-8') as output:
-                paths.append(cur_path)
-                generator = TOMLGenerator(output)
-
-                for guid, flds, mid, tags in self.col.db.execute(r"""
-SELECT guid, flds, mid, tags FROM notes
+        shards = []
+        models_written = False
+        for group_name, note_ids in self.note_groups():
+            cur_path = self.group_path(path, group_name)
+            output = ShardWriter(cur_path, self.shard_notes, self.shard_bytes, self.index)
+            try:
+                rows = self.col.db.execute(r"""
+SELECT guid, flds, mid, tags, sfld FROM notes
 WHERE id IN %s
-ORDER BY sfld""" % ids2str(note_ids)):
-                    field_data = splitFields(flds)
-                    cur_model = output_models[mid]
-                    output.write('[[notes]]\n')
-                    output.write("model = '%s'\n" % cur_model.name)
-                    output.write("guid = '%s'\n" % guid)
-                    for i, name in enumerate(cur_model.field_names):
-                        f = field_data[i]
-                        if name == u'note-id':
-                            try:
-                                f = int(f)
-                            except ValueError:
-                                pass
-                        generator.write_key_value(name, f)
-                    tags = self.fixup_tags(tags)
-                    generator.write_key_value(u'tags', tags)
-                    output.write('\n')
-                    count += 1
+ORDER BY sfld""" % ids2str(note_ids))
+                if self.pipeline:
+                    count += self.export_rows_pipelined(output, rows, output_models)
+                else:
+                    count += self.export_rows(output, rows, output_models)
+                if cur_path == path and not output.sharded:
+                    # append the models before closing so the file's digest covers them
+                    output.write(self.models_toml(output_models))
+                    models_written = True
+            finally:
+                group_shards = output.close()
+            for shard in group_shards:
+                paths.append(shard['path'])
+                shard['set'] = group_name
+                shards.append(shard)
+
+        if not models_written:
+            mode = 'a' if path in paths else 'w'
+            with codecs.open(path, mode, encoding='utf-8') as output:
+                output.write(self.models_toml(output_models))
+
+        if self.shard_notes or self.shard_bytes:
+            self.write_shard_index(path, shards)
+
+        if verify:
+            self.verify(paths)
+        self.count = count
+        return True
 
-        mode = 'a' if not sets else 'w'
+    @staticmethod
+    def models_toml(output_models):
         filtered_models = []
         for v in output_models.values():
             n = v.model.copy()
@@ -246,15 +481,151 @@ ORDER BY sfld""" % ids2str(note_ids)):
             n['tags'] = []
             n.pop('req', None)
             filtered_models.append(n)
+        return toml.dumps({'models': filtered_models})
 
-        with codecs.open(path, mode, encoding='utf-8') as output:
-            data = {'models': filtered_models}
-            toml.dump(output, data)
+    def note_groups(self):
+        """
+        Return a list of (set name, note ids) for the notes selected by the query and sets.
+        """
+        grouped_notes = []
+        if self.query is not None:
+            if self.sets:
+                for group_name, expr in self.sets.items():
+                    grouped_notes.append((group_name, self.col.findNotes('(%s) (%s)' % (self.query, expr))))
+            else:
+                grouped_notes.append(('', self.col.findNotes('%s' % self.query)))
+        else:
+            grouped_notes.append(('', self.cardIds()))
+        return grouped_notes
 
-        if verify:
-            self.verify(paths)
-        self.count = count
-        return True
+    @staticmethod
+    def group_path(path, group_name):
+        if group_name:
+            dirname = os.path.dirname(path)
+            return os.path.join(dirname, group_name + '.toml')
+        return path
+
+    def write_note(self, output, generator, output_models, guid, flds, mid, tags):
+        """
+        Write one note and return its note-id field value, if it has one.
+        """
+        note_id = None
+        field_data = splitFields(flds)
+        cur_model = output_models[mid]
+        if self.transform_plans is not None:
+            plan = self.transform_plans[mid]
+            if plan is not None:
+                field_data = plan.apply(field_data)
+        output.write('[[notes]]\n')
+        output.write("model = '%s'\n" % cur_model.name)
+        output.write("guid = '%s'\n" % guid)
+        for name, f in izip(cur_model.field_names, field_data):
+            if name == u'note-id':
+                try:
+                    f = int(f)
+                except ValueError:
+                    pass
+                note_id = f
+            self.write_field(generator, name, f)
+        tags = self.fixup_tags(tags)
+        generator.write_key_value(u'tags', tags)
+        output.write('\n')
+        return note_id
+
+    def write_field(self, generator, name, f):
+        blobs = self.blobs
+        # a code point takes at most 4 bytes, skip encoding values that can't reach the threshold
+        if blobs is not None and isinstance(f, unicode) and len(f) * 4 >= self.blob_threshold:
+            data = f.encode('utf-8')
+            if len(data) >= self.blob_threshold:
+                generator.write_key_blob(name, blobs.put(data), len(data))
+                return
+        generator.write_key_value(name, f)
+
+    def export_rows(self, output, rows, output_models):
+        generator = TOMLGenerator(output, self.compact)
+        count = 0
+        for guid, flds, mid, tags, sfld in rows:
+            output.start_note(sfld, guid)
+            note_id = self.write_note(output, generator, output_models, guid, flds, mid, tags)
+            output.end_note(note_id)
+            count += 1
+        return count
+
+    def export_rows_pipelined(self, output, rows, output_models):
+        """
+        Export rows with serialization and disk writes running in their own threads, connected by bounded queues.
+        Rows are read on the calling thread since the collection's sqlite connection is bound to it.
+        """
+        generator = TOMLGenerator(None, self.compact)
+
+        def serialize(batch):
+            notes = []
+            for guid, flds, mid, tags, sfld in batch:
+                buf = TextBuffer()
+                generator.output = buf
+                note_id = self.write_note(buf, generator, output_models, guid, flds, mid, tags)
+                notes.append((sfld, guid, note_id, buf.getvalue()))
+            return notes
+
+        def write(notes):
+            for sort_key, guid, note_id, text in notes:
+                output.start_note(sort_key, guid)
+                output.write(text)
+                output.end_note(note_id)
+
+        row_queue = Queue.Queue(self.pipeline_depth)
+        text_queue = Queue.Queue(self.pipeline_depth)
+        stages = [PipelineStage('serializer', serialize, row_queue, text_queue),
+                  PipelineStage('writer', write, text_queue)]
+        for stage in stages:
+            stage.start()
+
+        count = 0
+        read_time = stall = 0.0
+        batch_size = self.pipeline_batch
+        try:
+            t0 = time.time()
+            while not any(stage.error for stage in stages):
+                batch = rows.fetchmany(batch_size)
+                t1 = time.time()
+                read_time += t1 - t0
+                if not batch:
+                    break
+                row_queue.put(batch)
+                t0 = time.time()
+                stall += t0 - t1
+                count += len(batch)
+        finally:
+            row_queue.put(None)
+            for stage in stages:
+                stage.join()
+
+        self.stage_stats.append(('reader', read_time, stall))
+        for stage in stages:
+            self.stage_stats.append((stage.name, stage.busy, stage.stall))
+        for stage in stages:
+            if stage.error:
+                raise stage.error[0], stage.error[1], stage.error[2]
+        return count
+
+    @staticmethod
+    def shard_index_path(path):
+        return os.path.splitext(path)[0] + '.index.toml'
+
+    def write_shard_index(self, path, shards, with_models=True):
+        """
+        Write the shard index next to path. Shard paths are stored relative to the index so the export can be moved.
+        """
+        index_path = self.shard_index_path(path)
+        dirname = os.path.dirname(index_path)
+        for shard in shards:
+            shard['path'] = os.path.relpath(shard['path'], dirname)
+        data = {'shards': shards}
+        if with_models:
+            data['models'] = os.path.relpath(path, dirname)
+        with codecs.open(index_path, 'w', encoding='utf-8') as output:
+            toml.dump(output, data)
 
     re_tag_fixup = re.compile(r'(?:marked|leech)(\s+|\Z)')
 
@@ -267,19 +638,29 @@ ORDER BY sfld""" % ids2str(note_ids)):
         """
         lel at this shitty verify function
         """
+        # imported here so that exporting does not need the GUI, e.g. in the daemon
+        from aqt.utils import showWarning
         p1 = subprocess.Popen(['cat'] + paths, stdout=subprocess.PIPE)
         p2 = subprocess.Popen(['tomljson'], stdin=p1.stdout, stdout=subprocess.PIPE)
         p1.stdout.close()
         exp_data = json.loads(p2.communicate()[0])
         notes = exp_data['notes']
         note_tbl = {}
+        blob_directory = self.blobs.directory if self.blobs is not None else None
         for n in notes:
+            if blob_directory:
+                resolve_blobs(n, blob_directory)
             note_tbl[n['note-id']] = n
 
-        for flds, in self.col.db.execute(r"""
-SELECT flds FROM notes
+        for flds, mid in self.col.db.execute(r"""
+SELECT flds, mid FROM notes
 WHERE id IN %s""" % ids2str(note_tbl.keys())):
             flds = splitFields(flds)
+            if self.transform_plans is not None:
+                # compare against what was exported, not the raw fields
+                plan = self.transform_plans[mid]
+                if plan is not None:
+                    flds = list(plan.apply(flds))
             nid = flds[0]
             want = flds[1]
             n = note_tbl[int(nid)]
@@ -287,4 +668,118 @@ WHERE id IN %s""" % ids2str(note_tbl.keys())):
                 showWarning('Mismatch text %s\n\nWant %s\n\nGot %s' % (nid, repr(want), repr(n['text'])))
             want = flds[2]
             if want != n['extra']:
-                showWarning('Mismatch extra %s\n\nWant %s\n\nGot %s' % (nid, repr(want), repr(n['extra'])))
\ No newline at end of file
+                showWarning('Mismatch extra %s\n\nWant %s\n\nGot %s' % (nid, repr(want), repr(n['extra'])))
+
+
+class TOMLReviewExporter(TOMLNoteExporter):
+    """
+    Exports the scheduling state of cards and their review history, grouped by note guid.
+
+    Notes are processed in chunks of chunk_size, and the cards and revlog rows of a chunk are streamed from
+    sqlite ordered by note, so memory use does not depend on the size of the collection.
+    """
+    key = _("Cards and review history in TOML format")
+    ext = ".toml"
+
+    CARD_COLUMNS = ('id', 'ord', 'did', 'type', 'queue', 'due', 'ivl', 'factor', 'reps', 'lapses', 'left',
+                    'odue', 'odid', 'flags', 'mod')
+    REVLOG_COLUMNS = ('id', 'ease', 'ivl', 'lastIvl', 'factor', 'time', 'type')
+
+    def __init__(self, col, query=None, sets=None, set_name='', shard_notes=None, shard_bytes=None,
+                 index=False, chunk_size=1000, output_models=None, **kwargs):
+        """
+        Create a TOML Review Exporter. Note field options of TOMLNoteExporter are rejected with a ValueError
+        when set, output_models is accepted and unused.
+
+        :param chunk_size: Number of notes whose cards and reviews are fetched per query.
+        """
+        unsupported = sorted(k for k, v in kwargs.items() if v)
+        if unsupported:
+            raise ValueError('Options not supported by the reviews exporter: %s' % ', '.join(unsupported))
+        TOMLNoteExporter.__init__(self, col, query=query, sets=sets, set_name=set_name,
+                                  shard_notes=shard_notes, shard_bytes=shard_bytes, index=index)
+        self.chunk_size = chunk_size
+
+    def doExport(self, path, verify=False):
+        if verify:
+            raise ValueError('Verification is not supported by the reviews exporter')
+        count = 0
+        shards = []
+        chunk_size = self.chunk_size
+        for group_name, note_ids in self.note_groups():
+            note_ids = sorted(note_ids)
+            output = ShardWriter(self.group_path(path, group_name), self.shard_notes, self.shard_bytes, self.index)
+            try:
+                generator = TOMLGenerator(output)
+                for i in xrange(0, len(note_ids), chunk_size):
+                    count += self.export_chunk(output, generator, note_ids[i:i + chunk_size])
+            finally:
+                group_shards = output.close()
+            for shard in group_shards:
+                shard['set'] = group_name
+                shards.append(shard)
+
+        if self.shard_notes or self.shard_bytes:
+            self.write_shard_index(path, shards, with_models=False)
+        self.count = count
+        return True
+
+    def export_chunk(self, output, generator, note_ids):
+        db = self.col.db
+        ids = ids2str(note_ids)
+        notes = db.execute("SELECT id, guid FROM notes WHERE id IN %s ORDER BY id" % ids)
+        cards = db.execute("SELECT nid, %s FROM cards WHERE nid IN %s ORDER BY nid, id"
+                           % (', '.join(self.CARD_COLUMNS), ids))
+        revlog = db.execute(r"""
+SELECT c.nid, r.cid, %s FROM revlog r JOIN cards c ON c.id = r.cid
+WHERE c.nid IN %s
+ORDER BY c.nid, r.cid, r.id""" % (', '.join('r.' + c for c in self.REVLOG_COLUMNS), ids))
+
+        card_columns = self.CARD_COLUMNS
+        revlog_columns = self.REVLOG_COLUMNS
+        card = next(cards, None)
+        review = next(revlog, None)
+        count = 0
+        for nid, guid in notes:
+            # notes are written in id order, so the id is the shard sort key
+            output.start_note(nid, guid)
+            output.write('[[notes]]\n')
+            output.write("guid = '%s'\n" % guid)
+            output.write('\n')
+            while card is not None and card[0] == nid:
+                cid = card[1]
+                output.write('[[notes.cards]]\n')
+                for name, v in izip(card_columns, islice(card, 1, None)):
+                    generator.write_key_value(name, v)
+                output.write('\n')
+                while review is not None and review[1] == cid:
+                    output.write('[[notes.cards.reviews]]\n')
+                    for name, v in izip(revlog_columns, islice(review, 2, None)):
+                        generator.write_key_value(name, v)
+                    output.write('\n')
+                    review = next(revlog, None)
+                card = next(cards, None)
+            output.end_note()
+            count += 1
+        return count
+
+
+EXPORTERS = {
+    'notes': TOMLNoteExporter,
+    'reviews': TOMLReviewExporter,
+}
+
+
+def profile_exporter(col, profile, **kwargs):
+    """
+    Create the exporter selected by a parsed export profile, configured with the profile's options.
+    Extra keyword arguments are passed on to the exporter.
+    """
+    shard = profile.get('shard', {})
+    exporter_class = EXPORTERS[profile.get('exporter', 'notes')]
+    return exporter_class(col, query=profile['query'], sets=profile.get('sets', []),
+                          shard_notes=shard.get('notes'), shard_bytes=shard.get('bytes'),
+                          pipeline=profile.get('pipeline', False), blob_threshold=profile.get('blob-threshold'),
+                          compact=profile.get('compact', False), index=profile.get('index', False),
+                          transforms=profile.get('transforms'), media_prefix=profile.get('media-prefix', u''),
+                          **kwargs)
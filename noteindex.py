@@ -0,0 +1,81 @@
+# coding=utf-8
+import hashlib
+import json
+import os
+
+import pytoml as toml
+from blobs import default_translator
+
+
+class NoteIndex(object):
+    """
+    Random access to the notes of an export file through the guid index written next to it by the exporter.
+
+    The index is checked against the file's size on open, and against its SHA-1 digest too when verify is set.
+    """
+    def __init__(self, path, verify=True, translate=None):
+        """
+        :param translate: A pytoml translate function used to parse notes. Defaults to a blobs.BlobTranslator
+            when the export has a blobs directory next to it, so offloaded fields come back as BlobRefs.
+        """
+        self.path = path
+        self.translate = translate if translate is not None else default_translator(path)
+        with open(path + '.idx', 'rb') as f:
+            index = json.load(f)
+        self.notes = index['notes']
+        self.note_ids = index['note-ids']
+        self.sort_keys = index['sort-keys']
+        if os.path.getsize(path) != index['size']:
+            raise ValueError('%s does not match its index size' % path)
+        self.file = open(path, 'rb')
+        if verify:
+            sha1 = hashlib.sha1()
+            for chunk in iter(lambda: self.file.read(1 << 20), b''):
+                sha1.update(chunk)
+            if sha1.hexdigest() != index['sha1']:
+                self.file.close()
+                raise ValueError('%s does not match its index digest' % path)
+
+    def __contains__(self, guid):
+        return guid in self.notes
+
+    def __len__(self):
+        return len(self.notes)
+
+    def read(self, guid):
+        """
+        Return the TOML text of the note with guid.
+        """
+        offset, length = self.notes[guid]
+        self.file.seek(offset)
+        return self.file.read(length).decode('utf-8')
+
+    def get(self, guid):
+        """
+        Parse and return the note with guid, raising KeyError if it isn't in the file.
+        """
+        s = self.read(guid)
+        if self.translate is not None:
+            data = toml.loads(s, filename=self.path, translate=self.translate)
+        else:
+            data = toml.loads(s, filename=self.path)
+        return data['notes'][0]
+
+    def get_by_note_id(self, note_id):
+        # JSON object keys are always strings
+        return self.get(self.note_ids[str(note_id)])
+
+    def get_by_sort_key(self, sort_key):
+        """
+        Return the list of notes with the sort field value sort_key.
+        """
+        return [self.get(guid) for guid in self.sort_keys.get(unicode(sort_key), [])]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -1,3 +1,5 @@
 from .core import TomlError
 from .parser import load, loads
+from .cache import ParseCache
+from .parallel import load_parallel, loads_parallel
 from .writer import dump, dumps
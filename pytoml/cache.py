@@ -0,0 +1,90 @@
+import hashlib, os, tempfile
+from .parser import loads
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class ParseCache:
+    """
+    An on-disk cache of parsed TOML documents.
+
+    Entries are keyed by the absolute path, size, mtime and SHA-1 of the file contents, so a hit still reads
+    and hashes the file but skips parsing. Older entries for the same path are dropped on store and the least
+    recently used entries are evicted once the directory holds more than max_size bytes.
+    """
+    suffix = '.pickle'
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def load(self, fin):
+        s = fin.read()
+        path = getattr(fin, 'name', None)
+        if not isinstance(path, (str, type(u''))) or not os.path.isfile(path):
+            return loads(s, filename=path or '<string>')
+
+        st = os.stat(path)
+        raw = s.encode('utf-8') if not isinstance(s, bytes) else s
+        path_key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        content_key = hashlib.sha1('{0}:{1}:'.format(st.st_size, st.st_mtime).encode('ascii') + raw).hexdigest()
+        prefix = path_key + '-'
+        entry = os.path.join(self.directory, prefix + content_key + self.suffix)
+
+        try:
+            with open(entry, 'rb') as f:
+                r = pickle.load(f)
+            os.utime(entry, None)
+            return r
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        r = loads(s, filename=path)
+        self._store(entry, prefix, r)
+        return r
+
+    def _store(self, entry, prefix, value):
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix):
+                self._remove(os.path.join(self.directory, name))
+
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, entry)
+        except (IOError, OSError, pickle.PicklingError):
+            self._remove(tmp)
+            return
+        self._trim()
+
+    def _trim(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            p = os.path.join(self.directory, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, p in entries:
+            if total <= self.max_size:
+                break
+            self._remove(p)
+            total -= size
+
+    @staticmethod
+    def _remove(p):
+        try:
+            os.remove(p)
+        except OSError:
+            pass
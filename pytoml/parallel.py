@@ -0,0 +1,150 @@
+import bisect, multiprocessing, re
+from .core import TomlError
+from .parser import loads, _translate
+
+# tokens that matter when looking for split points: top level array of tables headers, table headers, strings,
+# comments and brackets of array values
+_scan_re = re.compile(r'''^[ \t]*(\[\[)[ \t]*[A-Za-z0-9_-]+[ \t]*\]\]|^[ \t]*\[[ \t]*([A-Za-z0-9_-]+(?:[ \t]*\.[ \t]*[A-Za-z0-9_-]+)*)[ \t]*\]|"""|\'\'\'|"(?:[^"\\\n]|\\.)*"|'[^'\n]*'|#[^\n]*|[\[\]]''', re.M)
+
+def load_parallel(fin, translate=_translate, processes=None, min_chunk=1 << 20):
+    return loads_parallel(fin.read(), filename=fin.name, translate=translate, processes=processes, min_chunk=min_chunk)
+
+def loads_parallel(s, filename='<string>', translate=_translate, processes=None, min_chunk=1 << 20):
+    """
+    Parse s like loads, splitting it at top level [[name]] headers and parsing the pieces in a process pool.
+    Documents smaller than two chunks of min_chunk characters are parsed directly. translate must be picklable.
+    """
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
+    s = s.replace('\r\n', '\n')
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    n = min(processes * 2, len(s) // min_chunk)
+    if processes < 2 or n < 2:
+        return loads(s, filename=filename, translate=translate)
+
+    points = split_points(s)
+    starts = [0]
+    for k in range(1, n):
+        i = bisect.bisect_left(points, k * len(s) // n)
+        if i < len(points) and points[i] > starts[-1]:
+            starts.append(points[i])
+    if len(starts) < 2:
+        return loads(s, filename=filename, translate=translate)
+
+    jobs = []
+    line = 0
+    ends = starts[1:] + [len(s)]
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        if i:
+            line += s.count('\n', starts[i - 1], start)
+        jobs.append((s[start:end], filename, line, translate))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_parse_chunk, jobs)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    for ok, r in results:
+        if not ok:
+            raise TomlError(r[0], r[1], r[2], filename)
+    check_tables(s, starts, filename)
+    root = {}
+    for (ok, r), job in zip(results, jobs):
+        merge(root, r, job[2] + 1, filename)
+    return root
+
+def _parse_chunk(job):
+    s, filename, line, translate = job
+    try:
+        return True, loads(s, filename=filename, translate=translate)
+    except TomlError as e:
+        return False, (e.message, e.line + line, e.col)
+
+def merge(dst, src, line, filename):
+    for k, v in src.items():
+        if k not in dst:
+            dst[k] = v
+            continue
+        cur = dst[k]
+        if isinstance(cur, list) and isinstance(v, list) and all(isinstance(t, dict) for t in cur + v):
+            cur.extend(v)
+        elif isinstance(cur, dict) and isinstance(v, dict):
+            merge(cur, v, line, filename)
+        elif not isinstance(cur, dict) and not isinstance(v, dict):
+            raise TomlError('duplicate_tables', line, 1, filename)
+        else:
+            raise TomlError('key_table_conflict', line, 1, filename)
+
+def check_tables(s, starts, filename):
+    """
+    Raise the duplicate_tables error of loads for a [name] table whose header appears in more than one of the
+    chunks of s beginning at starts, which merge can't tell from a table extended by subtables.
+    """
+    chunks = {}
+    for offset, name in table_headers(s):
+        chunk = bisect.bisect_right(starts, offset) - 1
+        if chunks.setdefault(name, chunk) != chunk:
+            raise TomlError('duplicate_tables', s.count('\n', 0, offset) + 1, 1, filename)
+
+def split_points(s):
+    """
+    Return the offsets of all [[name]] headers outside of strings and array values.
+    """
+    return _scan(s)[0]
+
+def table_headers(s):
+    """
+    Return the offsets and names, as tuples of keys, of all [name] headers with bare keys outside of strings.
+    """
+    return _scan(s)[1]
+
+def _scan(s):
+    points = []
+    headers = []
+    depth = 0
+    pos = 0
+    search = _scan_re.search
+    while True:
+        m = search(s, pos)
+        if not m:
+            break
+        tok = m.group(0)
+        pos = m.end()
+        if m.group(1):
+            if depth == 0:
+                points.append(m.start())
+        elif m.group(2):
+            if depth == 0:
+                headers.append((m.start(), tuple(k.strip() for k in m.group(2).split('.'))))
+        elif tok == '"""' or tok == "'''":
+            pos = _ml_string_end(s, pos, tok)
+        elif tok == '[':
+            depth += 1
+        elif tok == ']':
+            depth = max(depth - 1, 0)
+    return points, headers
+
+def _ml_string_end(s, pos, delim):
+    while True:
+        i = s.find(delim, pos)
+        if i == -1:
+            return len(s)
+        if delim == '"""':
+            backslashes = 0
+            while s[i - 1 - backslashes] == '\\':
+                backslashes += 1
+            if backslashes % 2:
+                pos = i + 1
+                continue
+        end = i + 3
+        # up to two quotes may precede the closing delimiter
+        while end < len(s) and end - i < 5 and s[end] == delim[0]:
+            end += 1
+        return end
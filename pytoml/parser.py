@@ -6,10 +6,15 @@ if sys.version_info[0] == 2:
 else:
     _chr = chr
 
-def load(fin, translate=lambda t, x, v: v):
+def _translate(t, x, v):
+    return v
+
+def load(fin, translate=_translate, cache=None):
+    if cache is not None and translate is _translate:
+        return cache.load(fin)
     return loads(fin.read(), translate=translate, filename=fin.name)
 
-def loads(s, filename='<string>', translate=lambda t, x, v: v):
+def loads(s, filename='<string>', translate=_translate):
     if isinstance(s, bytes):
         s = s.decode('utf-8')
 
@@ -348,6 +353,9 @@ class _TimeZone(datetime.tzinfo):
     def __init__(self, offset):
         self._offset = offset
 
+    def __getinitargs__(self):
+        return (self._offset,)
+
     def utcoffset(self, dt):
         return self._offset
 
@@ -0,0 +1,239 @@
+# coding=utf-8
+import os
+import re
+import warnings
+
+import pytoml as toml
+from pytoml.parallel import check_tables, merge, split_points
+from blobs import BlobRef, blob_directory, is_blob_ref
+
+
+def toml_field_names(field_names):
+    """
+    Transform names to be unquoted TOML key friendly.
+    Do it only if it will not cause ambiguity.
+    """
+    field_set = set(field_names)
+
+    def transform_name(name):
+        n = name.lower().replace(' ', '-')
+        return n if n not in field_set else name
+
+    return [transform_name(fn) for fn in field_names]
+
+
+class RecordModel(object):
+    """
+    The field keys of one exported model, shared by all of its note records
+    """
+    __slots__ = ('name', 'keys', 'index', 'model')
+
+    def __init__(self, model):
+        self.name = model['name']
+        self.model = model
+        self.keys = tuple(toml_field_names([f['name'] for f in model['flds']]))
+        self.index = dict((k, i) for i, k in enumerate(self.keys))
+
+
+class NoteRecord(object):
+    """
+    A note stored as a tuple of field values in model field order. Supports read-only dict style access
+    with the same keys as the note table it was built from.
+    """
+    __slots__ = ('model', 'guid', 'tags', 'values')
+
+    def __init__(self, model, guid, tags, values):
+        self.model = model
+        self.guid = guid
+        self.tags = tags
+        self.values = values
+
+    def __getitem__(self, key):
+        i = self.model.index.get(key)
+        if i is not None:
+            v = self.values[i]
+            # offloaded fields are read when accessed
+            return v.value if isinstance(v, BlobRef) else v
+        if key == 'model':
+            return self.model.name
+        if key == 'guid':
+            return self.guid
+        if key == 'tags':
+            return self.tags
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.model.index or key in ('model', 'guid', 'tags')
+
+    def keys(self):
+        return ['model', 'guid'] + list(self.model.keys) + ['tags']
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __eq__(self, other):
+        return dict(self.items()) == (dict(other.items()) if isinstance(other, NoteRecord) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'NoteRecord(%r)' % dict(self.items())
+
+
+class RecordBuilder(object):
+    """
+    Turns note tables into NoteRecords for the given [[models]] tables, sharing identical tag strings.
+    With blob_directory, blob references are kept as BlobRefs and read when the field is accessed.
+    """
+    def __init__(self, models, blob_directory=None):
+        self.models = dict((m['name'], RecordModel(m)) for m in models)
+        self.blob_directory = blob_directory
+        self.tag_pool = {}
+
+    def record(self, note):
+        """
+        Return the NoteRecord for a note table, or the table itself if its keys don't match its model's fields.
+        """
+        model = self.models.get(note.get('model'))
+        if model is None or len(note) != len(model.keys) + 3 or 'guid' not in note or 'tags' not in note:
+            return note
+        try:
+            values = tuple([note[k] for k in model.keys])
+        except KeyError:
+            return note
+        if self.blob_directory is not None:
+            values = tuple([BlobRef(self.blob_directory, v['blob'], v['size']) if is_blob_ref(v) else v
+                            for v in values])
+        tags = note['tags']
+        tags = self.tag_pool.setdefault(tags, tags)
+        return NoteRecord(model, note['guid'], tags, values)
+
+
+def compact(data, blob_directory=None):
+    """
+    Replace the note tables in already loaded export data with NoteRecords, in place.
+    """
+    builder = RecordBuilder(data.get('models', []), blob_directory)
+    notes = data.get('notes', [])
+    for i, note in enumerate(notes):
+        notes[i] = builder.record(note)
+    return data
+
+
+_header_name_re = re.compile(r'[ \t]*\[\[[ \t]*([A-Za-z0-9_-]+)')
+
+
+def _chunks(s):
+    """
+    Split a document at its top level [[name]] headers into (name, start, end, line) tuples.
+    """
+    starts = split_points(s)
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    ends = starts[1:] + [len(s)]
+    chunks = []
+    line = 0
+    prev = 0
+    for start, end in zip(starts, ends):
+        line += s.count('\n', prev, start)
+        prev = start
+        m = _header_name_re.match(s, start)
+        chunks.append((m.group(1) if m else None, start, end, line))
+    return chunks
+
+
+def _parse_chunk(s, chunk, filename, kwargs):
+    name, start, end, line = chunk
+    try:
+        return toml.loads(s[start:end], filename=filename, **kwargs)
+    except toml.TomlError as e:
+        raise toml.TomlError(e.message, e.line + line, e.col, filename)
+
+
+def _decode(s):
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
+    if '\r\n' in s:
+        s = s.replace('\r\n', '\n')
+    return s
+
+
+def load_models(path):
+    """
+    Return the [[models]] tables of an export, given its main file or its shard index. Only the models are
+    parsed, not the notes stored with them.
+    """
+    with open(path, 'rb') as f:
+        s = _decode(f.read())
+    root = {}
+    for chunk in _chunks(s):
+        if chunk[0] == 'models':
+            merge(root, _parse_chunk(s, chunk, path, {}), chunk[3] + 1, path)
+    if root.get('models'):
+        return root['models']
+    # a shard index names the file holding the models
+    index = toml.loads(s, filename=path)
+    if isinstance(index.get('models'), basestring):
+        return load_models(os.path.join(os.path.dirname(path), index['models']))
+    raise ValueError('%s has no [[models]] tables' % path)
+
+
+def load(fin, translate=None, models=None):
+    """
+    Load an export like pytoml.load, with notes stored as NoteRecords. Blob references are resolved from the
+    blobs directory next to the file, if there is one.
+
+    Shard and set files don't contain the [[models]] tables, the main export does; pass its path or the shard
+    index path as models, or the model tables themselves, to get records for them too.
+    """
+    if isinstance(models, basestring):
+        models = load_models(models)
+    directory = blob_directory(fin.name)
+    return loads(fin.read(), filename=fin.name, translate=translate,
+                 blob_directory=directory if os.path.isdir(directory) else None, models=models)
+
+
+def loads(s, filename='<string>', translate=None, blob_directory=None, models=None):
+    """
+    Parse an export with notes stored as NoteRecords.
+
+    The document is split at its top level [[name]] headers. The [[models]] tables are parsed first, then every
+    [[notes]] table is parsed on its own and turned into a record right away, so no dict per note is kept and
+    no syntax tree of the whole document is built.
+
+    :param models: [[models]] tables to use when the document has none of its own, as for shard and set files.
+        Without any, the notes stay plain tables and a warning is issued.
+    """
+    s = _decode(s)
+    kwargs = {'translate': translate} if translate is not None else {}
+    chunks = _chunks(s)
+    check_tables(s, [chunk[1] for chunk in chunks], filename)
+
+    root = {}
+    for chunk in chunks:
+        if chunk[0] == 'models':
+            merge(root, _parse_chunk(s, chunk, filename, kwargs), chunk[3] + 1, filename)
+    record_models = root.get('models') or models
+    if not record_models and any(chunk[0] == 'notes' for chunk in chunks):
+        warnings.warn('%s has no [[models]] tables, its notes are loaded as plain tables' % filename)
+    builder = RecordBuilder(record_models or [], blob_directory)
+
+    notes = []
+    for chunk in chunks:
+        if chunk[0] == 'models':
+            continue
+        d = _parse_chunk(s, chunk, filename, kwargs)
+        if chunk[0] == 'notes' and isinstance(d.get('notes'), list):
+            notes.extend(builder.record(note) for note in d.pop('notes'))
+        if d:
+            merge(root, d, chunk[3] + 1, filename)
+    if notes:
+        root.setdefault('notes', []).extend(notes)
+    return root
@@ -0,0 +1,114 @@
+# coding=utf-8
+import re
+import unicodedata
+from itertools import izip
+
+from anki.utils import stripHTML
+
+
+def nfc(options):
+    return lambda s: unicodedata.normalize('NFC', s)
+
+
+def strip_html(options):
+    return stripHTML
+
+
+def media_paths(options):
+    """
+    Prefix the file names of images and sounds with the profile's media-prefix, leaving URLs and absolute paths.
+    """
+    prefix = options.get('media-prefix', u'')
+    img_re = re.compile(r'''(<img[^>]*?\ssrc=["']?)([^"'>\s]+)''', re.IGNORECASE)
+    sound_re = re.compile(r'\[sound:([^\]]+)\]')
+
+    def rewrite(name):
+        if name.startswith('/') or '://' in name or name.startswith('data:'):
+            return name
+        return prefix + name
+
+    def transform(s):
+        s = img_re.sub(lambda m: m.group(1) + rewrite(m.group(2)), s)
+        return sound_re.sub(lambda m: u'[sound:%s]' % rewrite(m.group(1)), s)
+    return transform
+
+
+TRANSFORMS = {
+    'nfc': nfc,
+    'strip-html': strip_html,
+    'media-paths': media_paths,
+}
+
+
+def unknown_transforms(config):
+    """
+    Return the transform names used in a profile's transforms table that don't exist.
+    """
+    return sorted(set(name for fields in config.values() for names in fields.values() for name in names
+                      if name not in TRANSFORMS))
+
+
+class CachedTransform(object):
+    """
+    A chain of transforms applied to one field, remembering the results for values seen before.
+    Only values of up to max_length characters are remembered, long values rarely repeat and would make the cache
+    large, and the cache is dropped whenever it grows beyond cache_size entries.
+    """
+    def __init__(self, funcs, cache_size, max_length=256):
+        self.funcs = funcs
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self.cache = {}
+
+    def transform(self, s):
+        for func in self.funcs:
+            s = func(s)
+        return s
+
+    def __call__(self, s):
+        if len(s) > self.max_length:
+            return self.transform(s)
+        cache = self.cache
+        r = cache.get(s)
+        if r is None:
+            r = self.transform(s)
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[s] = r
+        return r
+
+
+class TransformPlan(object):
+    """
+    The transforms of each field of one model, compiled once from the profile's transforms table for the model:
+
+        [transforms.Basic]
+        text = ["strip-html", "nfc"]
+        extra = ["media-paths"]
+    """
+    def __init__(self, field_names, fields, options, cache_size=4096):
+        self.steps = []
+        for name in field_names:
+            names = fields.get(name)
+            if names:
+                step = CachedTransform([TRANSFORMS[n](options) for n in names], cache_size)
+            else:
+                step = None
+            self.steps.append(step)
+
+    def apply(self, field_data):
+        """
+        Generate the transformed values of a note's fields.
+        """
+        for step, f in izip(self.steps, field_data):
+            yield f if step is None else step(f)
+
+
+def compile_plan(output_model, config, options):
+    """
+    Return the TransformPlan of an OutputModel, or None if the profile has no transforms for it.
+    """
+    fields = config.get(output_model.name)
+    if not fields:
+        return None
+    return TransformPlan(output_model.field_names, fields, options)
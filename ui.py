@@ -4,7 +4,8 @@ from aqt import mw
 from aqt.qt import *
 from aqt.utils import showWarning, tooltip
 
-from exporter import TOMLNoteExporter
+from exporter import EXPORTERS, profile_exporter
+from transforms import unknown_transforms
 import pytoml as toml
 
 class ExportDialog(QDialog):
@@ -28,10 +29,17 @@ class ExportDialog(QDialog):
     def on_accept(self):
         ok = self.readValues()
         if ok:
-            exporter = TOMLNoteExporter(mw.col, query=mw.ankisport.query, sets=mw.ankisport.sets)
-            ok = exporter.doExport(mw.ankisport.output_path, verify=mw.ankisport.verify)
+            try:
+                exporter = profile_exporter(mw.col, mw.ankisport.profile)
+                ok = exporter.doExport(mw.ankisport.output_path, verify=mw.ankisport.verify)
+            except ValueError as e:
+                showWarning(str(e))
+                ok = False
             if ok:
-                tooltip("Exported %d notes" % exporter.count, parent=self.mw)
+                msg = "Exported %d notes" % exporter.count
+                for name, busy, stall in exporter.stage_stats:
+                    msg += "<br>%s: %.2fs busy, %.2fs stalled" % (name, busy, stall)
+                tooltip(msg, parent=self.mw)
         if ok:
             QDialog.accept(self)
 
@@ -67,6 +75,14 @@ class ExportDialog(QDialog):
 
         with open(mw.ankisport.profile_path, 'r') as f:
             t = toml.load(f)
+        if t.get('exporter', 'notes') not in EXPORTERS:
+            showWarning("Unknown exporter '%s'" % t['exporter'])
+            return False
+        unknown = unknown_transforms(t.get('transforms', {}))
+        if unknown:
+            showWarning("Unknown transforms: %s" % ', '.join(unknown))
+            return False
+        mw.ankisport.profile = t
         mw.ankisport.query = t['query']
         mw.ankisport.sets = t.get('sets', [])
         return True
@@ -111,6 +127,7 @@ class Settings(object):
         dir = QDesktopServices.storageLocation(QDesktopServices.DesktopLocation)
         self.profile_path = os.path.join(dir, "settings.toml")
         self.output_path = os.path.join(dir, "export.toml")
+        self.profile = {}
         self.query = ""
         self.sets = []
         self.verify = False